@@ -0,0 +1,65 @@
+import random
+import time
+
+from scoring import net_profit, score_catalog
+
+USERS = 10_000
+DEALS = 5_000
+RETAILERS = ['Amazon', 'Best Buy', 'Walmart', 'Target', 'Costco', 'Staples', 'Apple', 'Sam\'s Club']
+LOOP_SAMPLE_USERS = 20
+
+
+def make_deals(count: int) -> list:
+    deals = []
+    for deal_id in range(count):
+        retail = round(random.uniform(10, 1500), 2)
+        deals.append({
+            'deal_id': deal_id,
+            'retail_price': retail,
+            'payout_price': round(retail * random.uniform(0.9, 1.15), 2),
+            'retailers': random.choice(RETAILERS),
+        })
+    return deals
+
+
+def make_profiles(count: int) -> dict:
+    profiles = {}
+    for user_id in range(count):
+        profile = {
+            'tax': random.choice([0, 6, 7.25, 8.875]),
+            'cashback': random.choice([0, 1, 1.5, 2, 5]),
+            'portal': random.choice([0, 0.5, 1]),
+            'shipping': random.choice([0, 0, 5]),
+            'retailers': {},
+        }
+        for retailer in random.sample(RETAILERS, random.randint(0, 2)):
+            profile['retailers'][retailer.lower()] = {'cashback': random.choice([3, 5])}
+        profiles[str(user_id)] = profile
+    return profiles
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    deals = make_deals(DEALS)
+    profiles = make_profiles(USERS)
+
+    start = time.perf_counter()
+    scores = score_catalog(deals, profiles)
+    vectorized = time.perf_counter() - start
+
+    # The per-user per-deal Python loop, timed on a sample and extrapolated
+    sample = list(profiles)[:LOOP_SAMPLE_USERS]
+    start = time.perf_counter()
+    expected = [[net_profit(deal, profiles[user_id]) for deal in deals] for user_id in sample]
+    looped = (time.perf_counter() - start) * USERS / LOOP_SAMPLE_USERS
+
+    max_error = max(
+        abs(scores.net[scores.user_rows[user_id]][position] - value)
+        for user_id, row in zip(sample, expected)
+        for position, value in enumerate(row)
+    )
+
+    print(f"{USERS} users x {DEALS} deals ({USERS * DEALS:,} scores)")
+    print(f"Vectorized pass: {vectorized:.2f}s")
+    print(f"Python loop (extrapolated from {LOOP_SAMPLE_USERS} users): {looped:.2f}s")
+    print(f"Speedup: {looped / vectorized:.0f}x, max abs difference: ${max_error:.4f}")
@@ -1,12 +1,24 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ForceReply, InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton
+from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters, ConversationHandler, InlineQueryHandler
+from telegram.helpers import escape_markdown
+import asyncio
 import logging
 import requests
 import json
 import os
+import re
+import secrets
+import time
 from datetime import datetime
+from itertools import takewhile
 from dotenv import load_dotenv
 from bfmr import BFMRAPI
+from catalog import DealCatalog, deal_profit, deal_profit_percent, deal_retailers
+from facets import CatalogFacets
+from ledger import ReservationLedger
+from scoring import CatalogScores, PROFILE_FIELDS, net_profit
+from snapshot import SnapshotPersistence
+from watcher import DealWatcher, RESERVED, RETRY, FAILED
 
 # Load environment variables
 load_dotenv()
@@ -26,9 +38,70 @@ if not TOKEN:
 # States for the setup conversation
 APIKEY, APISECRET = range(2)
 
-# Store user credentials (in memory - would use database in production)
+# Store user credentials (in memory - would use database in production).
+# Each user maps to a list of BFMR accounts; the first one is the primary
+# account used for browsing deals.
 user_credentials = {}
 
+# Maximum number of reservation requests in flight for a single commit
+COMMIT_FANOUT = int(os.getenv('COMMIT_FANOUT', '5'))
+
+# Local record of reservations made through the bot, per user and account
+reservation_ledger = ReservationLedger()
+
+# Most recent deals listed by /mycommits (totals always cover every deal)
+MYCOMMITS_DEALS = 30
+
+# Reservation errors worth watching the deal for, and the global cap on
+# upstream calls made by deal watchers
+RETRYABLE_ERRORS = ("reservations is closed", "quantity reserved failed")
+WATCH_MAX_POLLS_PER_MINUTE = int(os.getenv('WATCH_MAX_POLLS_PER_MINUTE', '30'))
+
+# Pending "Watch and retry" offers kept per user; the button only carries a
+# short key since Telegram caps callback data at 64 bytes
+WATCH_OFFERS = 20
+
+# Shared catalog of active deals, kept in sync by every deal fetch
+deal_catalog = DealCatalog()
+
+# Facet bitmaps over the catalog, rebuilt once per catalog change
+deal_facets = CatalogFacets(deal_catalog)
+
+# Per-user net profit profiles (tax, cashback and portal rates in percent,
+# shipping in dollars, optional per-retailer overrides) and the net profit
+# of every deal for every profiled user
+user_profiles = {}
+deal_scores = CatalogScores(deal_catalog, user_profiles)
+
+# Local snapshots of catalog and session state for warm restarts
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '30'))
+
+# Seconds before a warm catalog is refreshed in the background
+CATALOG_TTL = float(os.getenv('CATALOG_TTL', '60'))
+
+# Background catalog refresh in flight, if any
+catalog_refresh_tasks = set()
+
+# Limits for the /top leaderboard command
+TOP_DEFAULT = 10
+TOP_MAX = 50
+
+# /filter: deals listed per reply, facet values shown per keyboard row group
+# and the closing windows offered as buttons
+FILTER_RESULTS = 10
+FILTER_BUTTONS = 6
+CLOSING_WINDOWS = {'24h': 24, '3d': 72, '7d': 168}
+
+# Inline query mode: results per page and client cache hint
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = 10
+
+# Users with an inline answer in flight, and the newest query each of them
+# sent meanwhile; older queries in a burst are superseded and never answered
+inline_in_flight = set()
+inline_pending = {}
+
 class UserBFMR:
     def __init__(self, api_key, api_secret):
         self.api_key = api_key
@@ -96,14 +169,191 @@ class UserBFMR:
             raise ValueError(f"Error testing credentials: {str(e)}")
 
 # Helper functions
+def get_user_accounts(user_id: str) -> list:
+    """Get the list of BFMR accounts registered by the user"""
+    return user_credentials.get(str(user_id), [])
+
 def get_user_bfmr(user_id: str) -> UserBFMR:
-    """Get a BFMR API instance for the user"""
-    if str(user_id) not in user_credentials:
+    """Get a BFMR API instance for the user's primary account"""
+    accounts = get_user_accounts(user_id)
+    if not accounts:
         return None
     
-    creds = user_credentials[str(user_id)]
+    creds = accounts[0]
     return UserBFMR(api_key=creds['api_key'], api_secret=creds['api_secret'])
 
+def split_quantity(accounts: list, qty: int):
+    """Spread a quantity evenly across accounts, none above its unit limit.
+
+    Units an account cannot take because of its limit go to the others, in
+    account order. Returns the (account, units) allocations and the units
+    left unallocated once every limited account is full.
+    """
+    units = [0] * len(accounts)
+    remaining = qty
+    open_accounts = list(range(len(accounts)))
+    while remaining > 0 and open_accounts:
+        share, extra = divmod(remaining, len(open_accounts))
+        still_open = []
+        for rank, position in enumerate(open_accounts):
+            wanted = share + (1 if rank < extra else 0)
+            limit = accounts[position].get('unit_limit')
+            given = min(wanted, limit - units[position]) if limit else wanted
+            units[position] += given
+            remaining -= given
+            if not limit or units[position] < limit:
+                still_open.append(position)
+        open_accounts = still_open
+    allocations = [(account, count) for account, count in zip(accounts, units) if count]
+    return allocations, remaining
+
+async def commit_across_accounts(accounts: list, deal_id: str, item_id: str, qty: int, budget=None):
+    """Reserve a quantity split across accounts with a bounded concurrent fan-out.
+
+    When a budget is given, one slot is acquired before every reservation call.
+    """
+    allocations, unallocated = split_quantity(accounts, qty)
+    semaphore = asyncio.Semaphore(COMMIT_FANOUT)
+    
+    async def reserve(account, units):
+        async with semaphore:
+            if budget is not None:
+                await budget.acquire()
+            bfmr = UserBFMR(api_key=account['api_key'], api_secret=account['api_secret'])
+            try:
+                result = await asyncio.to_thread(
+                    bfmr.commit_to_deal, deal_id=deal_id, item_id=item_id, item_qty=str(units)
+                )
+            except Exception as e:
+                logger.error(f"Error committing for {account.get('label')}: {e}")
+                result = {"success": False, "error": str(e)}
+        return account, units, result
+    
+    results = await asyncio.gather(*(reserve(account, units) for account, units in allocations))
+    return results, unallocated
+
+async def commit_for_user(user_id, deal_id: str, item_id: str, qty: int, budget=None):
+    """Reserve for a user with every account not already holding the item.
+
+    Accounts the ledger knows to hold a reservation are skipped without a
+    network call; returns (None, 0) when that leaves no account. Outcomes are
+    recorded in the ledger.
+    """
+    reserved = reservation_ledger.reserved_accounts(user_id, deal_id, item_id)
+    accounts = [account for account in get_user_accounts(user_id) if account['api_key'] not in reserved]
+    if not accounts:
+        return None, 0
+    
+    results, unallocated = await commit_across_accounts(accounts, deal_id, item_id, qty, budget=budget)
+    
+    deal = deal_catalog.get(deal_id)
+    for account, units, result in results:
+        if result.get('success'):
+            committed = units
+        elif "already reserved" in (result.get('error') or '').lower():
+            committed = None
+        else:
+            continue
+        reservation_ledger.record(
+            user_id, account['api_key'], account.get('label'), deal_id, item_id, committed, deal=deal
+        )
+    return results, unallocated
+
+def is_retryable(result: dict) -> bool:
+    """Whether a failed reservation may succeed once the deal reopens"""
+    api_message = (result.get('error') or '').lower()
+    return any(error in api_message for error in RETRYABLE_ERRORS)
+
+def format_commit_results(results: list, unallocated: int, qty: int) -> str:
+    """Summarize the per-account results of a commitment in one message"""
+    if len(results) == 1 and not unallocated:
+        _, _, result = results[0]
+        if result.get('success'):
+            return (
+                f"✅ Successfully committed to deal!\n"
+                f"Quantity: {qty}\n"
+                f"Please check your BFMR dashboard for next steps."
+            )
+        return f"❌ {describe_commit_error(result.get('error'))}"
+    
+    committed = sum(units for _, units, result in results if result.get('success'))
+    lines = [f"📋 Committed {committed} of {qty} units across {len(results)} accounts:", ""]
+    for account, units, result in results:
+        if result.get('success'):
+            lines.append(f"✅ {account.get('label')}: {units} units reserved")
+        else:
+            lines.append(f"❌ {account.get('label')}: {describe_commit_error(result.get('error'))}")
+    if unallocated:
+        lines.append(f"⚠️ {unallocated} units not placed: all account limits reached.")
+    lines.append("")
+    lines.append("Please check your BFMR dashboard for next steps.")
+    return "\n".join(lines)
+
+def describe_commit_error(error: str) -> str:
+    """Turn a BFMR reservation error into a user-facing message"""
+    api_message = (error or '').lower()
+    if "not available" in api_message:
+        return "This deal is no longer available."
+    elif "reservations is closed" in api_message:
+        return "This deal is currently closed for reservations."
+    elif "already reserved" in api_message:
+        return "You have already reserved this deal."
+    elif "limit exceeded" in api_message:
+        return "Reservation limit exceeded for this deal."
+    elif "quantity reserved failed" in api_message:
+        return "Unable to reserve the requested quantity. No units available."
+    return f"Unable to commit to deal: {error or 'Unknown error'}"
+
+async def fetch_deals(bfmr: UserBFMR, page_size: int = 50) -> list:
+    """Fetch active deals and sync them into the shared catalog"""
+    response = await asyncio.to_thread(bfmr.get_active_deals, page_size=page_size)
+    deals = response.get('deals', [])
+    deal_catalog.refresh(deals)
+    if user_profiles:
+        # Rescore in the background so net rankings are ready before they are asked for
+        deal_scores.refresh()
+    return deals
+
+async def refresh_catalog(user_id: str):
+    """Refresh the catalog in the background with the user's credentials"""
+    try:
+        await fetch_deals(get_user_bfmr(user_id))
+    except Exception as e:
+        logger.error(f"Error refreshing catalog: {e}")
+
+def schedule_catalog_refresh(user_id: str):
+    """Start a single background refresh if the catalog is older than CATALOG_TTL"""
+    stale = deal_catalog.updated_at is None or time.time() - deal_catalog.updated_at > CATALOG_TTL
+    if stale and not catalog_refresh_tasks:
+        task = asyncio.create_task(refresh_catalog(user_id))
+        catalog_refresh_tasks.add(task)
+        task.add_done_callback(catalog_refresh_tasks.discard)
+
+async def catalog_deals(user_id: str) -> list:
+    """Active deals served from the catalog.
+
+    Only a cold catalog waits on BFMR; a stale one is returned as is while a
+    single background refresh brings it up to date.
+    """
+    if not len(deal_catalog):
+        return await fetch_deals(get_user_bfmr(user_id))
+    
+    schedule_catalog_refresh(user_id)
+    return list(deal_catalog.deals.values())
+
+async def rank_for_user(user_id: str, deals: list):
+    """Order deals by the user's net profit, best first, when they have a profile.
+
+    Returns the deals and the user's net profit per deal id ({} without a
+    profile, in which case the order is left as is).
+    """
+    if user_id not in user_profiles:
+        return deals, {}
+    net_profits = (await deal_scores.scores()).for_user(user_id)
+    # Deals newer than the scores go last, in their original order
+    ranked = sorted(deals, key=lambda deal: -net_profits.get(str(deal.get('deal_id')), float('-inf')))
+    return ranked, net_profits
+
 async def check_credentials(update: Update) -> bool:
     """Check if user has configured API credentials"""
     if str(update.effective_user.id) not in user_credentials:
@@ -146,6 +396,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Setup process handlers
 async def setup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the setup process"""
+    context.user_data.pop('new_account', None)
     await update.message.reply_text(
         "🔑 Let's configure your BFMR API credentials.\n\n"
         "Please enter your BFMR API Public Key:\n"
@@ -190,11 +441,35 @@ async def api_secret_received(update: Update, context: ContextTypes.DEFAULT_TYPE
             return ConversationHandler.END
         
         # If credentials are valid, store them
-        user_credentials[str(update.effective_user.id)] = {
+        accounts = user_credentials.setdefault(str(update.effective_user.id), [])
+        account = {
             'api_key': api_key,
             'api_secret': api_secret,
+            'unit_limit': None,
             'setup_date': datetime.now().isoformat()
         }
+        new_account = context.user_data.pop('new_account', None)
+        
+        if new_account is not None and accounts:
+            account['label'] = f"Account {len(accounts) + 1}"
+            account['unit_limit'] = new_account.get('unit_limit')
+            accounts.append(account)
+            limit = account['unit_limit'] or 'no limit'
+            await update.message.reply_text(
+                f"✅ {account['label']} verified and added (units per commit: {limit}).\n\n"
+                "Each commit is now spread evenly across your accounts, and no account gets "
+                "more than its units per commit. Use /accounts to review them and "
+                "/accountlimit to change a limit."
+            )
+            return ConversationHandler.END
+        
+        # /setup (or a first account) sets the primary account
+        account['label'] = "Account 1"
+        if accounts:
+            account['unit_limit'] = accounts[0].get('unit_limit')
+            accounts[0] = account
+        else:
+            accounts.append(account)
         
         await update.message.reply_text(
             "✅ API credentials verified and saved successfully!\n\n"
@@ -202,6 +477,7 @@ async def api_secret_received(update: Update, context: ContextTypes.DEFAULT_TYPE
             "/deals - View all available deals\n"
             "/profitable - View all deals at or above retail\n"
             "/viewall - View all deals at once\n"
+            "/top [N] - Show the top N deals by profit\n"
             "/search [term] - Search for specific deals\n"
             "/help - Show all available commands"
         )
@@ -223,14 +499,95 @@ async def api_secret_received(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Clear sensitive data from context
     if 'api_key' in context.user_data:
         del context.user_data['api_key']
+    context.user_data.pop('new_account', None)
     
     return ConversationHandler.END
 
+async def addaccount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start adding another BFMR account, with an optional per-commit unit limit"""
+    if not await check_credentials(update):
+        return ConversationHandler.END
+    
+    unit_limit = None
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.message.reply_text(
+                "Usage: `/addaccount [units per commit]`\n"
+                "Example: `/addaccount 5`",
+                parse_mode='Markdown'
+            )
+            return ConversationHandler.END
+        unit_limit = int(context.args[0]) or None
+    
+    context.user_data['new_account'] = {'unit_limit': unit_limit}
+    await update.message.reply_text(
+        "🔑 Let's add another BFMR account.\n\n"
+        "Please enter the account's BFMR API Public Key:\n"
+        "(or use /cancel to cancel setup)",
+        reply_markup=ForceReply(selective=True)
+    )
+    return APIKEY
+
+async def accounts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's BFMR accounts"""
+    if not await check_credentials(update):
+        return
+    
+    lines = ["👥 Your BFMR accounts:", ""]
+    for number, account in enumerate(get_user_accounts(update.effective_user.id), start=1):
+        limit = account.get('unit_limit') or 'no limit'
+        primary = " (primary)" if number == 1 else ""
+        lines.append(f"{number}. {account.get('label', f'Account {number}')}{primary} - units per commit: {limit}")
+    lines.append("")
+    lines.append("/addaccount [units] - Add an account\n"
+                 "/accountlimit <number> <units> - Change an account's limit (0 = no limit)\n"
+                 "/removeaccount <number> - Remove an account")
+    await update.message.reply_text("\n".join(lines))
+
+async def accountlimit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Change the per-commit unit limit of an account"""
+    if not await check_credentials(update):
+        return
+    
+    accounts = get_user_accounts(update.effective_user.id)
+    args = context.args or []
+    if len(args) != 2 or not all(arg.isdigit() for arg in args) or not 1 <= int(args[0]) <= len(accounts):
+        await update.message.reply_text(
+            "Usage: `/accountlimit <account number> <units>` (0 = no limit)",
+            parse_mode='Markdown'
+        )
+        return
+    
+    account = accounts[int(args[0]) - 1]
+    account['unit_limit'] = int(args[1]) or None
+    await update.message.reply_text(
+        f"✅ {account.get('label')} units per commit: {account['unit_limit'] or 'no limit'}"
+    )
+
+async def removeaccount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove one of the user's additional BFMR accounts"""
+    if not await check_credentials(update):
+        return
+    
+    accounts = get_user_accounts(update.effective_user.id)
+    args = context.args or []
+    if len(args) != 1 or not args[0].isdigit() or not 2 <= int(args[0]) <= len(accounts):
+        await update.message.reply_text(
+            "Usage: `/removeaccount <account number>`\n"
+            "The primary account (1) can only be replaced with /setup.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    account = accounts.pop(int(args[0]) - 1)
+    await update.message.reply_text(f"🗑️ {account.get('label')} removed.")
+
 async def cancel_setup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the setup process"""
     # Clear any stored credentials
     if 'api_key' in context.user_data:
         del context.user_data['api_key']
+    context.user_data.pop('new_account', None)
     
     await update.message.reply_text(
         "❌ Setup cancelled.\n"
@@ -245,14 +602,22 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "*Available Commands:*\n"
         "/start - Start the bot\n"
         "/setup - Configure your API credentials\n"
+        "/addaccount [units] - Add another BFMR account\n"
+        "/accounts - List your BFMR accounts\n"
         "/viewall - View all deals at once\n"
         "/deals - Browse deals one at a time\n"
         "/profitable - View profitable deals only\n"
+        "/top [N] [by=$|%] - Show the top N deals by profit\n"
+        "/filter - Filter deals by retailer, type, price and more\n"
+        "/profile - Set tax, cashback and shipping for net profit\n"
         "/search [term] - Search for specific deals\n"
+        "/unwatch - Stop watching closed deals\n"
+        "/mycommits [clear deal_id|all] - List or clear your commitments\n"
         "/help - Show this help message\n\n"
         "💡 *Pro Tips:*\n"
         "• Use /viewall to see all available deals\n"
-        "• Try /search Macbook to find all Macbook deals\n\n"
+        "• Try /search Macbook to find all Macbook deals\n"
+        "• Type @ and the bot's username in any chat to search deals inline\n\n"
         "🔗 Visit [BuyingGroupPro.com](https://buyingrouppro.com) for more reselling tools!"
     )
     
@@ -275,23 +640,38 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error in error handler: {e}")
 
-async def send_deal_message(update: Update, deal: dict, is_reply: bool = False, show_navigation: bool = False):
+def format_deal_text(deal: dict, net_profit: float = None) -> str:
+    """Format a deal as a Markdown message, with deal fields escaped"""
+    text = (
+        f"🏷️ *{escape_markdown(str(deal.get('title', '')))}*\n\n"
+        f"💰 Retail: ${deal.get('retail_price', 0)}\n"
+        f"💵 Payout: ${deal.get('payout_price', 0)}\n"
+        f"📈 Profit: ${float(deal.get('payout_price', 0)) - float(deal.get('retail_price', 0)):.2f}\n"
+    )
+    if net_profit is not None:
+        text += f"💎 Your net profit: ${net_profit:.2f}\n"
+    text += (
+        f"🏪 Retailer: {escape_markdown(str(deal.get('retailers', '')))}\n"
+        f"📦 Type: {escape_markdown(str(deal.get('retail_type', '')))}\n"
+        f"⏰ Closing: {escape_markdown(str(deal.get('closing_at', '')))}\n"
+    )
+    
+    # Add footer
+    text += "\n🤖 *Powered by [BuyingGroupPro.com](https://buyinggrouppro.com)*"
+    return text
+
+async def send_deal_message(update: Update, deal: dict, is_reply: bool = False, show_navigation: bool = False,
+                            net_profit: float = None, user_id=None):
     """Send a formatted deal message"""
     try:
         # Format deal message
         deal_id = deal.get('deal_id', '')
-        text = (
-            f"🏷️ *{deal.get('title', '')}*\n\n"
-            f"💰 Retail: ${deal.get('retail_price', 0)}\n"
-            f"💵 Payout: ${deal.get('payout_price', 0)}\n"
-            f"📈 Profit: ${float(deal.get('payout_price', 0)) - float(deal.get('retail_price', 0)):.2f}\n"
-            f"🏪 Retailer: {deal.get('retailers', '')}\n"
-            f"📦 Type: {deal.get('retail_type', '')}\n"
-            f"⏰ Closing: {deal.get('closing_at', '')}\n"
-        )
+        text = format_deal_text(deal, net_profit=net_profit)
         
-        # Add footer
-        text += "\n🤖 *Powered by [BuyingGroupPro.com](https://buyinggrouppro.com)*"
+        # Items the user already committed to, straight from the ledger
+        if user_id is None and isinstance(update, Update):
+            user_id = update.effective_user.id
+        committed = reservation_ledger.committed_items(user_id, deal_id) if user_id else {}
         
         # Create buttons for each item
         keyboard = []
@@ -299,6 +679,9 @@ async def send_deal_message(update: Update, deal: dict, is_reply: bool = False,
             name_parts = item.get('name', '').split(' - ')
             color = item.get('color', '')
             button_text = f"Commit: {name_parts[0]} - {color}"
+            if str(item['id']) in committed:
+                units = committed[str(item['id'])]
+                button_text = f"✅ Committed{f' {units}' if units else ''}: {name_parts[0]} - {color}"
             callback_data = f"select_{deal_id}_{item['id']}"
             keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
         
@@ -340,11 +723,10 @@ async def deals_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     message = await update.message.reply_text("🔍 Fetching deals...")
-    bfmr = get_user_bfmr(str(update.effective_user.id))
     
     try:
-        response = bfmr.get_active_deals(page_size=50)
-        deals = response.get('deals', [])
+        user_id = str(update.effective_user.id)
+        deals, net_profits = await rank_for_user(user_id, await catalog_deals(user_id))
         
         if not deals:
             await message.edit_text("No deals available at the moment.")
@@ -356,7 +738,10 @@ async def deals_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Send first deal
         await message.delete()  # Delete the "Fetching deals..." message
-        await send_deal_message(update, deals[0], show_navigation=True)
+        await send_deal_message(
+            update, deals[0], show_navigation=True,
+            net_profit=net_profits.get(str(deals[0].get('deal_id')))
+        )
         
     except Exception as e:
         logger.error(f"Error fetching deals: {e}")
@@ -368,49 +753,327 @@ async def profitable_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
         
     message = await update.message.reply_text("🔍 Fetching profitable deals...")
-    bfmr = get_user_bfmr(str(update.effective_user.id))
     
     try:
-        response = bfmr.get_active_deals(page_size=50)
-        all_deals = response.get('deals', [])
-        
-        # Filter for profitable deals by calculating profit from retail and payout prices
-        profitable_deals = [
-            deal for deal in all_deals 
-            if float(deal.get('payout_price', 0)) > float(deal.get('retail_price', 0))
-        ]
+        user_id = str(update.effective_user.id)
+        await catalog_deals(user_id)
+        net_profits = {}
+        if user_id in user_profiles:
+            # Rank by the user's own net profit after tax, rewards and shipping
+            scores = await deal_scores.scores()
+            net_profits = scores.for_user(user_id)
+            # Scores may predate a refresh that dropped some deals
+            profitable_deals = [
+                deal for deal in map(deal_catalog.get, scores.ranked(user_id, positive_only=True))
+                if deal is not None
+            ]
+        else:
+            # The profit leaderboard is already sorted (highest first), so the
+            # profitable deals are simply its leading entries
+            profitable_deals = list(takewhile(
+                lambda deal: deal_profit(deal) > 0,
+                deal_catalog.top(by='profit')
+            ))
         
         if not profitable_deals:
             await message.edit_text("No profitable deals available at the moment.")
             return
         
-        # Sort by profit margin (highest first)
-        profitable_deals.sort(
-            key=lambda x: float(x.get('payout_price', 0)) - float(x.get('retail_price', 0)), 
-            reverse=True
-        )
-        
         await message.edit_text(f"Found {len(profitable_deals)} profitable deals")
         
         # Send each profitable deal
         for deal in profitable_deals:
-            await send_deal_message(update, deal, is_reply=True)
+            await send_deal_message(
+                update, deal, is_reply=True,
+                net_profit=net_profits.get(str(deal.get('deal_id')))
+            )
             
     except Exception as e:
         logger.error(f"Error fetching profitable deals: {e}")
         await message.edit_text("❌ Error fetching profitable deals. Please try again later.")
 
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the best deals straight from the catalog leaderboards"""
+    if not await check_credentials(update):
+        return
+    
+    limit = TOP_DEFAULT
+    by = 'profit'
+    retailer = None
+    for arg in context.args or []:
+        if arg.isdigit() and int(arg) > 0:
+            limit = min(int(arg), TOP_MAX)
+        elif arg.startswith('by=') and arg[3:] in ('$', '%', 'net'):
+            by = {'$': 'profit', '%': 'percent', 'net': 'net'}[arg[3:]]
+        elif arg.startswith('retailer=') and arg[9:]:
+            retailer = arg[9:].lower().replace('_', ' ')
+        else:
+            await update.message.reply_text(
+                "Usage: `/top [N] [by=$|%|net] [retailer=name]`\n"
+                "Use underscores for spaces, e.g. `retailer=best_buy`.\n"
+                "Example: `/top 5 by=%`",
+                parse_mode='Markdown'
+            )
+            return
+    
+    try:
+        # Only a cold catalog needs an upstream fetch; otherwise the
+        # leaderboard already holds the current ranking
+        user_id = str(update.effective_user.id)
+        await catalog_deals(user_id)
+        
+        net_profits = {}
+        if by == 'net':
+            if user_id not in user_profiles:
+                await update.message.reply_text("Set up your net profit profile first with /profile.")
+                return
+            scores = await deal_scores.scores()
+            net_profits = scores.for_user(user_id)
+            top_deals = [deal for deal in map(deal_catalog.get, scores.ranked(user_id)) if deal is not None]
+            if retailer:
+                top_deals = [deal for deal in top_deals if retailer.strip().lower() in deal_retailers(deal)]
+            top_deals = top_deals[:limit]
+        else:
+            top_deals = deal_catalog.top(limit, by=by, retailer=retailer)
+        if not top_deals:
+            await update.message.reply_text("No deals available at the moment.")
+            return
+        
+        metric = {'percent': "profit %", 'profit': "profit $", 'net': "your net profit"}[by]
+        header = f"🏆 Top {len(top_deals)} deals by {metric}"
+        if retailer:
+            header += f" at {retailer}"
+        lines = [header, ""]
+        for rank, deal in enumerate(top_deals, start=1):
+            lines.append(
+                f"{rank}. {deal.get('title', '')}\n"
+                f"    📈 ${deal_profit(deal):.2f} ({deal_profit_percent(deal):.1f}%) "
+                + (f"· 💎 net ${net_profits[str(deal.get('deal_id'))]:.2f} " if net_profits else "")
+                + f"· 🏪 {deal.get('retailers', '')}"
+            )
+        
+        await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+        
+    except Exception as e:
+        logger.error(f"Error building top deals: {e}")
+        await update.message.reply_text("❌ Error fetching top deals. Please try again later.")
+
+def describe_profile(profile: dict) -> str:
+    """Describe a net profit profile in /profile argument syntax"""
+    def describe(terms):
+        return ' '.join(f"{field}={terms[field]:g}" for field in PROFILE_FIELDS if field in terms)
+    
+    lines = [f"Default: {describe(profile) or 'none'}"]
+    for retailer, overrides in sorted(profile.get('retailers', {}).items()):
+        lines.append(f"{retailer}: {describe(overrides)}")
+    return "\n".join(lines)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show or change the user's net profit profile"""
+    if not await check_credentials(update):
+        return
+    
+    user_id = str(update.effective_user.id)
+    args = context.args or []
+    
+    if args == ['reset']:
+        user_profiles.pop(user_id, None)
+        deal_scores.update_user(user_id)
+        await update.message.reply_text("🧹 Net profit profile cleared. Deals are ranked by gross profit again.")
+        return
+    
+    if args:
+        terms = {}
+        retailer = None
+        for arg in args:
+            key, _, value = arg.partition('=')
+            key = key.lower()
+            if key == 'retailer' and value:
+                retailer = value.lower().replace('_', ' ')
+                continue
+            try:
+                amount = float(value)
+            except ValueError:
+                amount = None
+            if key not in PROFILE_FIELDS or amount is None or amount < 0:
+                await update.message.reply_text(
+                    "Usage: `/profile [tax=8.25] [cashback=2] [portal=1] [shipping=5] [retailer=name]`\n"
+                    "Rates are percentages of the retail price, shipping is dollars per unit.\n"
+                    "Add `retailer=` to override the values for one retailer, "
+                    "or send `/profile reset` to clear your profile.",
+                    parse_mode='Markdown'
+                )
+                return
+            terms[key] = amount
+        
+        profile = user_profiles.setdefault(user_id, {'retailers': {}})
+        if retailer:
+            profile['retailers'].setdefault(retailer, {}).update(terms)
+        else:
+            profile.update(terms)
+        deal_scores.update_user(user_id)
+    
+    profile = user_profiles.get(user_id)
+    if not profile:
+        await update.message.reply_text(
+            "You have no net profit profile yet.\n"
+            "Example: /profile tax=8.25 cashback=2 portal=1 shipping=0"
+        )
+        return
+    
+    await update.message.reply_text(
+        "💎 Your net profit profile:\n\n"
+        f"{describe_profile(profile)}\n\n"
+        "/deals, /viewall, /profitable, /search, /filter and /top by=net now rank deals by your net profit."
+    )
+
+def parse_range(text: str):
+    """Parse 'low-high', 'low-', '-high' or 'low' into [low, high]"""
+    low, _, high = text.partition('-')
+    try:
+        bounds = [float(low) if low else None, float(high) if high else None]
+    except ValueError:
+        return None
+    if bounds == [None, None]:
+        return None
+    return bounds
+
+def parse_filter_args(args: list):
+    """Parse /filter arguments into facet criteria (None if invalid)"""
+    criteria = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        key = key.lower()
+        value = value.strip().lower().replace('_', ' ')
+        if not sep or not value:
+            return None
+        if key in ('retailer', 'type'):
+            criteria[key] = [part.strip() for part in value.split(',') if part.strip()]
+        elif key == 'exclusive' and value in ('yes', 'no'):
+            criteria[key] = [value]
+        elif key in ('price', 'profit'):
+            criteria[key] = parse_range(value)
+            if criteria[key] is None:
+                return None
+        elif key == 'closing':
+            match = re.fullmatch(r'(\d+)([hd])', value)
+            if not match:
+                return None
+            criteria[key] = int(match.group(1)) * (24 if match.group(2) == 'd' else 1)
+        else:
+            return None
+    return criteria
+
+def describe_filters(criteria: dict) -> str:
+    """Describe active filters in /filter argument syntax"""
+    parts = []
+    for facet in ('retailer', 'type', 'exclusive'):
+        if criteria.get(facet):
+            parts.append(f"{facet}={','.join(criteria[facet])}")
+    for facet in ('price', 'profit'):
+        if criteria.get(facet):
+            low, high = criteria[facet]
+            parts.append(f"{facet}={'' if low is None else f'{low:g}'}-{'' if high is None else f'{high:g}'}")
+    if criteria.get('closing'):
+        parts.append(f"closing={criteria['closing']}h")
+    return ' '.join(parts) or 'none'
+
+async def render_filter(criteria: dict, user_id: str):
+    """Build the /filter reply text and facet keyboard for some criteria.
+
+    Results follow the user's net profit when they have a profile, gross
+    profit otherwise.
+    """
+    index = deal_facets.index()
+    bitmap = index.query(criteria)
+    counts = index.counts(criteria)
+    total = bitmap.bit_count()
+    
+    if user_id in user_profiles:
+        results, net_profits = await rank_for_user(user_id, index.results(bitmap))
+        results = results[:FILTER_RESULTS]
+    else:
+        results, net_profits = index.results(bitmap, FILTER_RESULTS), {}
+    
+    lines = [f"🔎 Filters: {describe_filters(criteria)}", f"Found {total} deals", ""]
+    for rank, deal in enumerate(results, start=1):
+        lines.append(
+            f"{rank}. {deal.get('title', '')}\n"
+            f"    📈 ${deal_profit(deal):.2f} ({deal_profit_percent(deal):.1f}%) "
+            + (f"· 💎 net ${net_profits[str(deal.get('deal_id'))]:.2f} " if str(deal.get('deal_id')) in net_profits else "")
+            + f"· 🏪 {deal.get('retailers', '')}"
+        )
+    if total > FILTER_RESULTS:
+        lines.append(f"\n(showing {FILTER_RESULTS} of {total} - narrow the filters to see more)")
+    
+    keyboard = []
+    labels = {'yes': "⭐ Exclusive", 'no': "Regular"}
+    for facet in ('retailer', 'type', 'exclusive'):
+        selected = criteria.get(facet) or []
+        values = sorted(counts[facet].items(), key=lambda pair: (-pair[1], pair[0]))[:FILTER_BUTTONS]
+        # Selected values always keep a button so they can be toggled off
+        shown = {value for value, _ in values}
+        values += [(value, counts[facet].get(value, 0)) for value in selected if value not in shown]
+        buttons = []
+        for value, count in values:
+            callback_data = f"facet_{facet}_{value}"
+            # Telegram rejects callback data over 64 bytes
+            if len(callback_data.encode()) > 64:
+                continue
+            mark = "✅ " if value in selected else ""
+            buttons.append(InlineKeyboardButton(f"{mark}{labels.get(value, value)} ({count})", callback_data=callback_data))
+        keyboard.extend(buttons[i:i + 3] for i in range(0, len(buttons), 3))
+    keyboard.append([
+        InlineKeyboardButton(
+            f"{'✅ ' if criteria.get('closing') == hours else ''}⏰ {window}",
+            callback_data=f"facet_closing_{window}"
+        )
+        for window, hours in CLOSING_WINDOWS.items()
+    ])
+    keyboard.append([InlineKeyboardButton("🧹 Clear filters", callback_data="facet_clear")])
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Filter deals by retailer, type, price, profit %, closing window and exclusivity"""
+    if not await check_credentials(update):
+        return
+    
+    if context.args:
+        criteria = parse_filter_args(context.args)
+        if criteria is None:
+            await update.message.reply_text(
+                "Usage: `/filter [retailer=a,b] [type=online] [price=100-500] "
+                "[profit=5-] [closing=24h] [exclusive=yes|no]`\n"
+                "Use underscores for spaces, e.g. `retailer=best_buy`.\n"
+                "Send /filter alone to pick facets with buttons.",
+                parse_mode='Markdown'
+            )
+            return
+        context.user_data['filters'] = criteria
+    criteria = context.user_data.setdefault('filters', {})
+    
+    try:
+        # Only a cold catalog needs an upstream fetch
+        await catalog_deals(str(update.effective_user.id))
+        
+        text, reply_markup = await render_filter(criteria, str(update.effective_user.id))
+        await update.message.reply_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+        
+    except Exception as e:
+        logger.error(f"Error filtering deals: {e}")
+        await update.message.reply_text("❌ Error filtering deals. Please try again later.")
+
 async def viewall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show all deals at once"""
     if not await check_credentials(update):
         return
         
     message = await update.message.reply_text("🔍 Fetching all deals...")
-    bfmr = get_user_bfmr(str(update.effective_user.id))
     
     try:
-        response = bfmr.get_active_deals(page_size=50)
-        deals = response.get('deals', [])
+        user_id = str(update.effective_user.id)
+        deals, net_profits = await rank_for_user(user_id, await catalog_deals(user_id))
         
         if not deals:
             await message.edit_text("No deals available at the moment.")
@@ -433,7 +1096,9 @@ async def viewall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard.append([InlineKeyboardButton("🌐 Visit BuyingGroupPro.com", url="https://buyingrouppro.com")])
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await send_deal_message(update, deal, is_reply=True)
+            await send_deal_message(
+                update, deal, is_reply=True, net_profit=net_profits.get(str(deal.get('deal_id')))
+            )
             
     except Exception as e:
         logger.error(f"Error fetching all deals: {e}")
@@ -457,6 +1122,46 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 reply_markup=ForceReply(selective=True)
             )
         
+        elif query.data.startswith('watch_'):
+            # Watch a closed or sold out deal and reserve once it reopens
+            offer = context.user_data.get('watch_offers', {}).pop(query.data[len('watch_'):], None)
+            await query.edit_message_reply_markup(reply_markup=None)
+            if offer is None:
+                await query.message.reply_text("This offer has expired. Please commit to the deal again.")
+                return
+            user_id = query.from_user.id
+            deal_watcher.watch(offer['deal_id'], (user_id, offer['item_id']), {
+                'user_id': user_id,
+                'chat_id': query.message.chat_id,
+                'item_id': offer['item_id'],
+                'qty': offer['qty'],
+                'bot': context.bot
+            })
+            await query.message.reply_text(
+                f"👀 Watching this deal. I'll reserve {offer['qty']} units as soon as it reopens.\n"
+                "Use /unwatch to stop watching."
+            )
+        
+        elif query.data.startswith('facet_'):
+            # Toggle a facet from the /filter keyboard and redraw the results
+            criteria = context.user_data.setdefault('filters', {})
+            if query.data == 'facet_clear':
+                criteria.clear()
+            else:
+                _, facet, value = query.data.split('_', 2)
+                if facet == 'closing':
+                    hours = CLOSING_WINDOWS[value]
+                    criteria['closing'] = None if criteria.get('closing') == hours else hours
+                else:
+                    selected = criteria.setdefault(facet, [])
+                    if value in selected:
+                        selected.remove(value)
+                    else:
+                        selected.append(value)
+            
+            text, reply_markup = await render_filter(criteria, str(query.from_user.id))
+            await query.message.edit_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+        
         elif query.data == 'view_profitable':
             await profitable_command(query, context)
             
@@ -474,7 +1179,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 new_index = (current_index - 1) % len(deals)
             
             context.user_data['current_deal_index'] = new_index
-            await send_deal_message(query.message, deals[new_index], show_navigation=True)
+            profile = user_profiles.get(str(query.from_user.id))
+            await send_deal_message(
+                query.message, deals[new_index], show_navigation=True, user_id=query.from_user.id,
+                net_profit=net_profit(deals[new_index], profile) if profile else None
+            )
             
     except Exception as e:
         logger.error(f"Error in button callback: {e}")
@@ -507,49 +1216,150 @@ async def handle_quantity_response(update: Update, context: ContextTypes.DEFAULT
         logger.info(f"Attempting to commit with cleaned IDs: deal_id={deal_id}, item_id={item_id}, qty={qty}")
         
         # Commit to the deal
-        bfmr = get_user_bfmr(str(update.effective_user.id))
-        if not bfmr:
+        if not get_user_accounts(update.effective_user.id):
             await update.message.reply_text("❌ Please configure your API credentials first using /setup")
             return
 
-        # Make the API request with cleaned IDs
-        result = bfmr.commit_to_deal(deal_id=deal_id, item_id=item_id, item_qty=qty)
-        
-        # Debug log the full API response
-        logger.info(f"Full API Response: {result}")
+        # Make the API requests with cleaned IDs, split across the user's accounts
+        results, unallocated = await commit_for_user(update.effective_user.id, deal_id, item_id, int(qty))
         
-        api_message = result.get('error', '').lower()
+        # Clear the pending commit before replying, so a failed reply cannot leave it behind
+        del context.user_data['pending_commit']
         
-        if result.get('success'):
+        if results is None:
             await update.message.reply_text(
-                f"✅ Successfully committed to deal!\n"
-                f"Quantity: {qty}\n"
-                f"Please check your BFMR dashboard for next steps."
+                "❌ You have already reserved this item with all of your accounts.\n"
+                "Use /mycommits to see your commitments, or /mycommits clear <deal_id> "
+                "if a reservation was cancelled."
             )
-        else:
-            # Handle specific error messages
-            if "not available" in api_message:
-                error_msg = "❌ This deal is no longer available."
-            elif "reservations is closed" in api_message:
-                error_msg = "❌ This deal is currently closed for reservations."
-            elif "already reserved" in api_message:
-                error_msg = "❌ You have already reserved this deal."
-            elif "limit exceeded" in api_message:
-                error_msg = "❌ Reservation limit exceeded for this deal."
-            elif "quantity reserved failed" in api_message:
-                error_msg = "❌ Unable to reserve the requested quantity. No units available."
-            else:
-                error_msg = f"❌ Unable to commit to deal: {result.get('error', 'Unknown error')}"
-            
-            await update.message.reply_text(error_msg)
-            
-        # Clear the pending commit
-        del context.user_data['pending_commit']
+            return
+        
+        # Debug log the full API responses
+        logger.info(f"Full API Responses: {[result for _, _, result in results]}")
+        
+        # Offer to watch the deal when it is only closed or sold out for now
+        reply_markup = None
+        if results and all(not result.get('success') and is_retryable(result) for _, _, result in results):
+            offers = context.user_data.setdefault('watch_offers', {})
+            offer = secrets.token_hex(4)
+            offers[offer] = {'deal_id': deal_id, 'item_id': item_id, 'qty': int(qty)}
+            while len(offers) > WATCH_OFFERS:
+                offers.pop(next(iter(offers)))
+            reply_markup = InlineKeyboardMarkup([[
+                InlineKeyboardButton("👀 Watch and retry", callback_data=f"watch_{offer}")
+            ]])
+        
+        await update.message.reply_text(
+            format_commit_results(results, unallocated, qty),
+            reply_markup=reply_markup
+        )
         
     except Exception as e:
         logger.error(f"Error handling quantity: {e}")
         await update.message.reply_text("❌ Error processing commitment. Please try again later.")
 
+async def retry_watched_commit(deal_id: str, watch: dict, budget) -> str:
+    """Retry a watched commitment; the deal watcher's poll for that deal"""
+    if not get_user_accounts(watch['user_id']):
+        return FAILED
+    
+    results, unallocated = await commit_for_user(
+        watch['user_id'], deal_id, watch['item_id'], watch['qty'], budget=budget
+    )
+    if results is None:
+        await watch['bot'].send_message(
+            watch['chat_id'],
+            "👀 Stopped watching a deal: you have already reserved this item with all of your accounts."
+        )
+        return FAILED
+    if all(not result.get('success') and is_retryable(result) for _, _, result in results):
+        return RETRY
+    
+    await watch['bot'].send_message(
+        watch['chat_id'],
+        "👀 Watched deal update:\n\n" + format_commit_results(results, unallocated, watch['qty'])
+    )
+    if any(result.get('success') for _, _, result in results):
+        return RESERVED
+    return FAILED
+
+async def expire_watched_commit(deal_id: str, watch: dict):
+    """Tell a user their watch ran out before the deal reopened"""
+    await watch['bot'].send_message(
+        watch['chat_id'],
+        "⌛ Stopped watching a deal: it did not reopen within 24 hours."
+    )
+
+# Shared pollers for deals users are waiting on
+deal_watcher = DealWatcher(
+    attempt=retry_watched_commit,
+    on_expire=expire_watched_commit,
+    max_polls_per_minute=WATCH_MAX_POLLS_PER_MINUTE
+)
+
+async def mycommits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's commitments from the local ledger, or clear some of them"""
+    if not await check_credentials(update):
+        return
+    
+    args = context.args or []
+    if args:
+        if args[0].lower() != 'clear' or len(args) != 2:
+            await update.message.reply_text(
+                "Usage: `/mycommits clear <deal_id>` or `/mycommits clear all`\n"
+                "Cleared reservations are no longer skipped when you commit again.",
+                parse_mode='Markdown'
+            )
+            return
+        deal_id = None if args[1].lower() == 'all' else args[1]
+        removed = reservation_ledger.clear(update.effective_user.id, deal_id)
+        if removed:
+            await update.message.reply_text(f"🧹 Cleared {removed} recorded reservation(s).")
+        else:
+            await update.message.reply_text("No matching commitments recorded.")
+        return
+    
+    entries = reservation_ledger.entries(update.effective_user.id)
+    if not entries:
+        await update.message.reply_text("You have no commitments recorded yet.")
+        return
+    
+    # Group by deal, most recently committed deals first
+    deals = {}
+    for entry in reversed(entries):
+        deals.setdefault(entry['deal_id'], []).append(entry)
+    
+    lines = ["📋 Your commitments:", ""]
+    for deal_id, deal_entries in list(deals.items())[:MYCOMMITS_DEALS]:
+        title = deal_entries[0]['title']
+        lines.append(f"🏷️ {title} (deal {deal_id})" if title else f"🏷️ Deal {deal_id}")
+        for entry in reversed(deal_entries):
+            units = f"{entry['qty']} units" if entry['qty'] is not None else "reserved outside the bot"
+            item = f"{entry['item_name'].split(' - ')[0]} · " if entry.get('item_name') else ""
+            lines.append(f"    • {item}{entry['label']}: {units}")
+    if len(deals) > MYCOMMITS_DEALS:
+        lines.append(f"\n(showing the {MYCOMMITS_DEALS} most recent of {len(deals)} deals)")
+    
+    counted = [entry for entry in entries if entry['qty'] is not None]
+    units = sum(entry['qty'] for entry in counted)
+    cost = sum(entry['qty'] * entry['retail_price'] for entry in counted)
+    payout = sum(entry['qty'] * entry['payout_price'] for entry in counted)
+    lines.append("")
+    lines.append(f"Total: {units} units across {len(deals)} deals")
+    lines.append(f"💰 Retail: ${cost:.2f} · 💵 Payout: ${payout:.2f} · 📈 Profit: ${payout - cost:.2f}")
+    lines.append("\nCancelled a reservation? Send /mycommits clear <deal_id> so the bot can reserve it again.")
+    
+    await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+
+async def unwatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop watching every deal the user is waiting on"""
+    user_id = update.effective_user.id
+    removed = deal_watcher.unwatch(lambda watch: watch['user_id'] == user_id)
+    if removed:
+        await update.message.reply_text(f"🛑 Stopped {removed} deal watch(es).")
+    else:
+        await update.message.reply_text("You are not watching any deals.")
+
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Search for deals by keyword"""
     if not await check_credentials(update):
@@ -566,11 +1376,10 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     search_term = ' '.join(context.args).lower()
     message = await update.message.reply_text(f"🔍 Searching for deals matching: *{search_term}*...", parse_mode='Markdown')
-    bfmr = get_user_bfmr(str(update.effective_user.id))
     
     try:
-        response = bfmr.get_active_deals(page_size=50)
-        all_deals = response.get('deals', [])
+        user_id = str(update.effective_user.id)
+        all_deals = await catalog_deals(user_id)
         
         # Search in deal titles and descriptions
         matching_deals = [
@@ -579,6 +1388,7 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             or search_term in deal.get('description', '').lower()
             or any(search_term in item.get('name', '').lower() for item in deal.get('items', []))
         ]
+        matching_deals, net_profits = await rank_for_user(user_id, matching_deals)
         
         if not matching_deals:
             await message.edit_text(f"No deals found matching: *{search_term}*", parse_mode='Markdown')
@@ -588,19 +1398,111 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Send each matching deal
         for deal in matching_deals:
-            await send_deal_message(update, deal, is_reply=True)
+            await send_deal_message(
+                update, deal, is_reply=True, net_profit=net_profits.get(str(deal.get('deal_id')))
+            )
             
     except Exception as e:
         logger.error(f"Error searching deals: {e}")
         await message.edit_text("❌ Error searching deals. Please try again later.")
 
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer inline queries (@bot term) from the in-memory catalog"""
+    query = update.inline_query
+    user_id = query.from_user.id
+    
+    if str(user_id) not in user_credentials:
+        await query.answer(
+            [],
+            cache_time=INLINE_CACHE_TIME,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="🔑 Set up your BFMR credentials", start_parameter="setup")
+        )
+        return
+    
+    # Answer right away; keystrokes arriving while an answer is in flight are
+    # coalesced so only the newest of them is answered next
+    if user_id in inline_in_flight:
+        inline_pending[user_id] = query
+        return
+    
+    inline_in_flight.add(user_id)
+    try:
+        while query is not None:
+            try:
+                await answer_inline_query(query)
+            except Exception as e:
+                logger.error(f"Error answering inline query: {e}")
+            query = inline_pending.pop(user_id, None)
+    finally:
+        inline_in_flight.discard(user_id)
+
+async def answer_inline_query(query):
+    """Answer one inline query with a page of matching deals.
+
+    Inline answers never wait on BFMR: a cold or stale catalog is refreshed
+    in the background and picked up by the next keystroke.
+    """
+    schedule_catalog_refresh(str(query.from_user.id))
+    if not len(deal_catalog) and catalog_refresh_tasks:
+        await query.answer(
+            [],
+            cache_time=0,
+            is_personal=True,
+            button=InlineQueryResultsButton(text="⏳ Loading deals, type again in a moment", start_parameter="deals")
+        )
+        return
+    
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    term = query.query.strip()
+    deals = deal_catalog.search(term) if term else deal_catalog.top(offset + INLINE_PAGE_SIZE + 1)
+    page = deals[offset:offset + INLINE_PAGE_SIZE]
+    
+    results = []
+    for deal in page:
+        reply_markup = None
+        product_url = next(
+            (link.get('url') for item in deal.get('items', []) or [] for link in item.get('retailer_links', []) or [] if link.get('url')),
+            None
+        )
+        if product_url:
+            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🛒 View Product", url=product_url)]])
+        results.append(InlineQueryResultArticle(
+            id=str(deal.get('deal_id')),
+            title=deal.get('title', ''),
+            description=(
+                f"📈 ${deal_profit(deal):.2f} ({deal_profit_percent(deal):.1f}%) · "
+                f"🏪 {deal.get('retailers', '')}"
+            ),
+            input_message_content=InputTextMessageContent(
+                format_deal_text(deal),
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            ),
+            reply_markup=reply_markup
+        ))
+    
+    next_offset = str(offset + INLINE_PAGE_SIZE) if len(deals) > offset + INLINE_PAGE_SIZE else ''
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True, next_offset=next_offset)
+
 def main():
     """Start the bot"""
-    app = Application.builder().token(TOKEN).build()
+    persistence = SnapshotPersistence(
+        SNAPSHOT_DIR,
+        catalog=deal_catalog,
+        credentials=user_credentials,
+        profiles=user_profiles,
+        ledger=reservation_ledger,
+        update_interval=SNAPSHOT_INTERVAL
+    )
+    app = Application.builder().token(TOKEN).persistence(persistence).build()
     
     # Setup conversation handler
     setup_handler = ConversationHandler(
-        entry_points=[CommandHandler('setup', setup_command)],
+        entry_points=[
+            CommandHandler('setup', setup_command),
+            CommandHandler('addaccount', addaccount_command)
+        ],
         states={
             APIKEY: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_key_received)],
             APISECRET: [MessageHandler(filters.TEXT & ~filters.COMMAND, api_secret_received)],
@@ -612,17 +1514,28 @@ def main():
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(setup_handler)
+    app.add_handler(CommandHandler("accounts", accounts_command))
+    app.add_handler(CommandHandler("accountlimit", accountlimit_command))
+    app.add_handler(CommandHandler("removeaccount", removeaccount_command))
     app.add_handler(CommandHandler("deals", deals_command))
     app.add_handler(CommandHandler("profitable", profitable_command))
     app.add_handler(CommandHandler("viewall", viewall_command))
+    app.add_handler(CommandHandler("top", top_command))
+    app.add_handler(CommandHandler("filter", filter_command))
+    app.add_handler(CommandHandler("profile", profile_command))
     app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CommandHandler("unwatch", unwatch_command))
+    app.add_handler(CommandHandler("mycommits", mycommits_command))
     app.add_handler(CallbackQueryHandler(button_callback))
+    app.add_handler(InlineQueryHandler(inline_query_handler, block=False))
     app.add_handler(MessageHandler(filters.TEXT & filters.REPLY, handle_quantity_response))
     
     app.add_error_handler(error_handler)
     
     print("Bot is running...")
-    app.run_polling(drop_pending_updates=True)
+    # Sessions survive restarts, so quantity replies sent while the bot was
+    # down are still answered instead of being dropped
+    app.run_polling(drop_pending_updates=False)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,275 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of recent search results kept per catalog version
+SEARCH_CACHE_SIZE = 256
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> list:
+    """Split text into lowercase alphanumeric search tokens"""
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+def deal_tokens(deal: dict) -> set:
+    """Search tokens for a deal's title, description and item names"""
+    tokens = set(tokenize(deal.get('title', '')))
+    tokens.update(tokenize(deal.get('description', '')))
+    for item in deal.get('items', []) or []:
+        tokens.update(tokenize(item.get('name', '')))
+    return tokens
+
+
+def deal_profit(deal: dict) -> float:
+    """Absolute profit of a deal (payout minus retail)"""
+    return float(deal.get('payout_price', 0) or 0) - float(deal.get('retail_price', 0) or 0)
+
+
+def deal_profit_percent(deal: dict) -> float:
+    """Profit of a deal as a percentage of its retail price"""
+    retail = float(deal.get('retail_price', 0) or 0)
+    if retail <= 0:
+        return 0.0
+    return deal_profit(deal) / retail * 100
+
+
+def deal_retailers(deal: dict) -> tuple:
+    """Normalized retailer keys for a deal (lowercase, de-duplicated)"""
+    retailers = deal.get('retailers') or []
+    if isinstance(retailers, str):
+        retailers = retailers.split(',')
+    keys = []
+    for retailer in retailers:
+        if isinstance(retailer, dict):
+            retailer = retailer.get('name', '')
+        key = str(retailer).strip().lower()
+        if key and key not in keys:
+            keys.append(key)
+    return tuple(keys)
+
+
+class Leaderboard:
+    """Deal ids kept sorted by descending score, updated one deal at a time"""
+
+    def __init__(self):
+        # Sorted list of (-score, deal_id) so the best deal is always first
+        self._entries = []
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, deal_id: str, score: float):
+        """Insert a deal or move it to its new position"""
+        old_score = self._scores.get(deal_id)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._remove_entry(deal_id, old_score)
+        insort(self._entries, (-score, deal_id))
+        self._scores[deal_id] = score
+
+    def discard(self, deal_id: str):
+        """Remove a deal if it is on the board"""
+        old_score = self._scores.pop(deal_id, None)
+        if old_score is not None:
+            self._remove_entry(deal_id, old_score)
+
+    def score(self, deal_id: str) -> float:
+        return self._scores[deal_id]
+
+    def top(self, n: int = None) -> list:
+        """Return the ids of the best n deals (all deals if n is None)"""
+        entries = self._entries if n is None else self._entries[:n]
+        return [deal_id for _, deal_id in entries]
+
+    def _remove_entry(self, deal_id: str, score: float):
+        index = bisect_left(self._entries, (-score, deal_id))
+        del self._entries[index]
+
+
+class SearchIndex:
+    """Inverted index from tokens to deal ids with prefix lookups"""
+
+    def __init__(self):
+        self._postings = {}
+        self._deal_tokens = {}
+        # Sorted vocabulary so every token sharing a prefix is one contiguous slice
+        self._vocabulary = []
+
+    def update(self, deal_id: str, tokens: set):
+        """Index a deal under a new set of tokens"""
+        old_tokens = self._deal_tokens.get(deal_id, set())
+        for token in old_tokens - tokens:
+            self._unlink(token, deal_id)
+        for token in tokens - old_tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._vocabulary, token)
+            postings.add(deal_id)
+        self._deal_tokens[deal_id] = tokens
+
+    def discard(self, deal_id: str):
+        """Remove a deal from the index"""
+        for token in self._deal_tokens.pop(deal_id, ()):
+            self._unlink(token, deal_id)
+
+    def match(self, query: str) -> set:
+        """Deal ids matching every query token as a word prefix"""
+        matches = None
+        for token in sorted(set(tokenize(query)), key=len, reverse=True):
+            start = bisect_left(self._vocabulary, token)
+            found = set()
+            for word in self._vocabulary[start:]:
+                if not word.startswith(token):
+                    break
+                found |= self._postings[word]
+            matches = found if matches is None else matches & found
+            if not matches:
+                return set()
+        return matches or set()
+
+    def _unlink(self, token: str, deal_id: str):
+        postings = self._postings[token]
+        postings.discard(deal_id)
+        if not postings:
+            del self._postings[token]
+            del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+
+class DealCatalog:
+    """In-memory catalog of active deals with incrementally maintained leaderboards.
+
+    Deals are stored once; the global and per-retailer leaderboards only hold
+    deal ids and scores, so adding a retailer board does not copy the catalog.
+    A search index over titles and item names is kept in step with the deals.
+    """
+
+    METRICS = {
+        'profit': deal_profit,
+        'percent': deal_profit_percent,
+    }
+
+    def __init__(self):
+        self.deals = {}
+        self.updated_at = None
+        self.version = 0
+        self._boards = {metric: Leaderboard() for metric in self.METRICS}
+        self._retailer_boards = {}
+        self._deal_retailers = {}
+        self._index = SearchIndex()
+        self._search_cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.deals)
+
+    def __contains__(self, deal_id):
+        return str(deal_id) in self.deals
+
+    def get(self, deal_id):
+        return self.deals.get(str(deal_id))
+
+    def upsert(self, deal: dict):
+        """Add a new deal or apply a repricing of an existing one"""
+        deal_id = str(deal.get('deal_id', ''))
+        if not deal_id or self.deals.get(deal_id) == deal:
+            return
+        self.deals[deal_id] = deal
+        self.version += 1
+
+        retailers = deal_retailers(deal)
+        old_retailers = self._deal_retailers.get(deal_id, ())
+        for retailer in set(old_retailers) - set(retailers):
+            self._discard_from_retailer(retailer, deal_id)
+        self._deal_retailers[deal_id] = retailers
+        self._index.update(deal_id, deal_tokens(deal))
+
+        for metric, score_fn in self.METRICS.items():
+            score = score_fn(deal)
+            self._boards[metric].update(deal_id, score)
+            for retailer in retailers:
+                board = self._retailer_boards.setdefault((retailer, metric), Leaderboard())
+                board.update(deal_id, score)
+
+    def remove(self, deal_id):
+        """Drop a closed deal from the catalog and every leaderboard"""
+        deal_id = str(deal_id)
+        if self.deals.pop(deal_id, None) is None:
+            return
+        self.version += 1
+        for board in self._boards.values():
+            board.discard(deal_id)
+        self._index.discard(deal_id)
+        for retailer in self._deal_retailers.pop(deal_id, ()):
+            self._discard_from_retailer(retailer, deal_id)
+
+    def refresh(self, deals: list):
+        """Sync the catalog with a full listing of active deals"""
+        seen = set()
+        for deal in deals:
+            self.upsert(deal)
+            seen.add(str(deal.get('deal_id', '')))
+        for deal_id in [deal_id for deal_id in self.deals if deal_id not in seen]:
+            self.remove(deal_id)
+        self.updated_at = time.time()
+        logger.info(f"Catalog refreshed: {len(self.deals)} active deals")
+
+    def top(self, n: int = None, by: str = 'profit', retailer: str = None) -> list:
+        """Return the best n deals ordered by the given metric"""
+        if by not in self.METRICS:
+            raise ValueError(f"Unknown leaderboard metric: {by}")
+        if retailer:
+            board = self._retailer_boards.get((retailer.strip().lower(), by))
+            if board is None:
+                return []
+        else:
+            board = self._boards[by]
+        return [self.deals[deal_id] for deal_id in board.top(n)]
+
+    def search(self, query: str) -> list:
+        """Deals matching a search query, most profitable first"""
+        key = (self.version, ' '.join(tokenize(query)))
+        deal_ids = self._search_cache.get(key)
+        if deal_ids is not None:
+            self._search_cache.move_to_end(key)
+        else:
+            board = self._boards['profit']
+            deal_ids = sorted(self._index.match(query), key=lambda deal_id: (-board.score(deal_id), deal_id))
+            self._search_cache[key] = deal_ids
+            if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                self._search_cache.popitem(last=False)
+        return [self.deals[deal_id] for deal_id in deal_ids]
+
+    def to_snapshot(self) -> dict:
+        """Plain data for persisting the catalog to disk"""
+        return {
+            'updated_at': self.updated_at,
+            'deals': list(self.deals.values()),
+        }
+
+    def load_snapshot(self, data: dict):
+        """Restore a catalog written by to_snapshot"""
+        for deal in data.get('deals', []):
+            self.upsert(deal)
+        self.updated_at = data.get('updated_at')
+        logger.info(f"Catalog restored: {len(self.deals)} deals")
+
+    def retailers(self) -> list:
+        """Known retailer keys, alphabetically"""
+        return sorted({retailer for retailer, _ in self._retailer_boards})
+
+    def _discard_from_retailer(self, retailer: str, deal_id: str):
+        for metric in self.METRICS:
+            board = self._retailer_boards.get((retailer, metric))
+            if board is None:
+                continue
+            board.discard(deal_id)
+            if not len(board):
+                del self._retailer_boards[(retailer, metric)]
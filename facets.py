@@ -0,0 +1,145 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+import logging
+import time
+
+from catalog import deal_profit, deal_profit_percent, deal_retailers
+
+logger = logging.getLogger(__name__)
+
+# Facets matched by value; every other facet is a numeric range
+CATEGORICAL_FACETS = ('retailer', 'type', 'exclusive')
+
+
+def parse_closing(value):
+    """Parse a deal's closing_at into a unix timestamp (None if unknown)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+class SortedBitmap:
+    """Sorted numeric index answering range queries as bitmaps.
+
+    prefix[i] holds the bits of the i smallest values, so any range is the
+    difference of two prefixes and costs two bisects and one big-int op.
+    """
+
+    def __init__(self, pairs: list):
+        pairs = sorted(pairs)
+        self.values = [value for value, _ in pairs]
+        self.prefix = [0]
+        for _, slot in pairs:
+            self.prefix.append(self.prefix[-1] | (1 << slot))
+
+    def range(self, low=None, high=None) -> int:
+        start = 0 if low is None else bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect_right(self.values, high)
+        if start >= end:
+            return 0
+        return self.prefix[end] & ~self.prefix[start]
+
+
+class FacetIndex:
+    """Per-facet bitmaps over a snapshot of the catalog.
+
+    Each deal gets a bit position (slot), assigned in descending profit order
+    so that walking the set bits of a result yields the best deals first.
+    Filters are answered with bitwise ANDs instead of re-scanning deals.
+    """
+
+    def __init__(self, deals: list):
+        deals = sorted(deals, key=deal_profit, reverse=True)
+        self.deals = deals
+        self.all = (1 << len(deals)) - 1
+        self.values = {facet: {} for facet in CATEGORICAL_FACETS}
+        prices, profits, closings = [], [], []
+
+        for slot, deal in enumerate(deals):
+            bit = 1 << slot
+            for retailer in deal_retailers(deal):
+                self._add('retailer', retailer, bit)
+            retail_type = str(deal.get('retail_type') or '').strip().lower()
+            if retail_type:
+                self._add('type', retail_type, bit)
+            self._add('exclusive', 'yes' if deal.get('is_exclusive_deal') else 'no', bit)
+
+            prices.append((float(deal.get('retail_price', 0) or 0), slot))
+            profits.append((deal_profit_percent(deal), slot))
+            closing = parse_closing(deal.get('closing_at'))
+            if closing is not None:
+                closings.append((closing, slot))
+
+        self.ranges = {
+            'price': SortedBitmap(prices),
+            'profit': SortedBitmap(profits),
+            'closing': SortedBitmap(closings),
+        }
+        logger.info(f"Facet index built over {len(deals)} deals")
+
+    def _add(self, facet: str, value: str, bit: int):
+        values = self.values[facet]
+        values[value] = values.get(value, 0) | bit
+
+    def query(self, criteria: dict, exclude: str = None) -> int:
+        """Bitmap of deals matching every facet in criteria (except exclude)"""
+        result = self.all
+        for facet in CATEGORICAL_FACETS:
+            selected = criteria.get(facet)
+            if facet == exclude or not selected:
+                continue
+            bitmap = 0
+            for value in selected:
+                bitmap |= self.values[facet].get(value, 0)
+            result &= bitmap
+        for facet in ('price', 'profit'):
+            bounds = criteria.get(facet)
+            if facet != exclude and bounds:
+                result &= self.ranges[facet].range(*bounds)
+        hours = criteria.get('closing')
+        if exclude != 'closing' and hours:
+            now = time.time()
+            result &= self.ranges['closing'].range(now, now + hours * 3600)
+        return result
+
+    def counts(self, criteria: dict) -> dict:
+        """Matches per categorical facet value, applying all other facets"""
+        counts = {}
+        for facet in CATEGORICAL_FACETS:
+            base = self.query(criteria, exclude=facet)
+            counts[facet] = {
+                value: (bitmap & base).bit_count()
+                for value, bitmap in self.values[facet].items()
+            }
+        return counts
+
+    def results(self, bitmap: int, limit: int = None) -> list:
+        """Deals for the set bits of a bitmap, most profitable first"""
+        deals = []
+        while bitmap and (limit is None or len(deals) < limit):
+            low_bit = bitmap & -bitmap
+            deals.append(self.deals[low_bit.bit_length() - 1])
+            bitmap ^= low_bit
+        return deals
+
+
+class CatalogFacets:
+    """Facet index kept in step with a DealCatalog.
+
+    The index is rebuilt at most once per catalog change, on the first query
+    after the catalog's version moved.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._index = None
+        self._version = None
+
+    def index(self) -> FacetIndex:
+        if self._index is None or self._version != self.catalog.version:
+            self._version = self.catalog.version
+            self._index = FacetIndex(list(self.catalog.deals.values()))
+        return self._index
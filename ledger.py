@@ -0,0 +1,97 @@
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationLedger:
+    """Local record of each user's reservations, per account.
+
+    Entries are kept in commit order per user and indexed by (deal, item), so
+    duplicate reservations and already-committed items are known without a
+    round trip to BFMR. An entry with qty None marks a reservation BFMR
+    reported as already existing but that was not made through the bot.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        # (user_id, deal_id) -> item_id -> account -> units
+        self._deals = {}
+        self.version = 0
+
+    def record(self, user_id, account: str, label: str, deal_id: str, item_id: str, qty, deal: dict = None):
+        """Record a reservation made by one of the user's accounts"""
+        deal = deal or {}
+        entry = {
+            'deal_id': str(deal_id),
+            'item_id': str(item_id),
+            'account': account,
+            'label': label,
+            'qty': qty,
+            'title': deal.get('title', ''),
+            'item_name': next(
+                (item.get('name', '') for item in deal.get('items', []) or [] if str(item.get('id')) == str(item_id)),
+                ''
+            ),
+            'retail_price': float(deal.get('retail_price', 0) or 0),
+            'payout_price': float(deal.get('payout_price', 0) or 0),
+            'committed_at': datetime.now().isoformat()
+        }
+        self._entries.setdefault(str(user_id), []).append(entry)
+        self._index(str(user_id), entry)
+        self.version += 1
+
+    def reserved_accounts(self, user_id, deal_id, item_id) -> set:
+        """Accounts of the user already holding a reservation for an item"""
+        items = self._deals.get((str(user_id), str(deal_id)), {})
+        return set(items.get(str(item_id), {}))
+
+    def committed_items(self, user_id, deal_id) -> dict:
+        """Units committed per item of a deal (None if the quantity is unknown)"""
+        committed = {}
+        for item_id, accounts in self._deals.get((str(user_id), str(deal_id)), {}).items():
+            units = [qty for qty in accounts.values() if qty is not None]
+            committed[item_id] = sum(units) if units else None
+        return committed
+
+    def entries(self, user_id) -> list:
+        """The user's reservations in commit order"""
+        return list(self._entries.get(str(user_id), []))
+
+    def clear(self, user_id, deal_id: str = None) -> int:
+        """Forget the user's entries for a deal, or all of them; returns how many"""
+        user_id = str(user_id)
+        entries = self._entries.get(user_id, [])
+        kept = [entry for entry in entries if deal_id is not None and entry['deal_id'] != str(deal_id)]
+        removed = len(entries) - len(kept)
+        if not removed:
+            return 0
+        if kept:
+            self._entries[user_id] = kept
+        else:
+            self._entries.pop(user_id, None)
+        for key in [key for key in self._deals if key[0] == user_id and (deal_id is None or key[1] == str(deal_id))]:
+            del self._deals[key]
+        self.version += 1
+        return removed
+
+    def to_snapshot(self) -> dict:
+        """Plain data for persisting the ledger to disk"""
+        return {user_id: list(entries) for user_id, entries in self._entries.items()}
+
+    def load_snapshot(self, data: dict):
+        """Restore a ledger written by to_snapshot"""
+        for user_id, entries in data.items():
+            for entry in entries:
+                self._entries.setdefault(user_id, []).append(entry)
+                self._index(user_id, entry)
+        self.version += 1
+        logger.info(f"Ledger restored: {sum(len(entries) for entries in data.values())} reservations")
+
+    def _index(self, user_id: str, entry: dict):
+        items = self._deals.setdefault((user_id, entry['deal_id']), {})
+        accounts = items.setdefault(entry['item_id'], {})
+        if entry['qty'] is None:
+            accounts.setdefault(entry['account'], None)
+        else:
+            accounts[entry['account']] = (accounts.get(entry['account']) or 0) + entry['qty']
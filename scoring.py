@@ -0,0 +1,195 @@
+import asyncio
+import logging
+
+import numpy as np
+
+from catalog import deal_retailers
+
+logger = logging.getLogger(__name__)
+
+# Profile fields: percentages of the retail price, plus a flat shipping cost
+PROFILE_FIELDS = ('tax', 'cashback', 'portal', 'shipping')
+
+# Upper bound on the (users x deals) temporaries of a single scoring block
+BLOCK_ELEMENTS = 4_000_000
+
+
+def profile_terms(profile: dict, retailer: str) -> tuple:
+    """(cost factor, shipping) a profile applies to deals at a retailer.
+
+    The cost factor multiplies the retail price: sales tax adds to it, card
+    cashback and portal rewards take away from it.
+    """
+    terms = dict(profile)
+    terms.update(profile.get('retailers', {}).get(retailer, {}))
+    factor = 1 + (terms.get('tax', 0) - terms.get('cashback', 0) - terms.get('portal', 0)) / 100
+    return factor, terms.get('shipping', 0)
+
+
+def net_profit(deal: dict, profile: dict) -> float:
+    """Net profit of a single deal for a single profile"""
+    retailers = deal_retailers(deal)
+    factor, shipping = profile_terms(profile, retailers[0] if retailers else '')
+    retail = float(deal.get('retail_price', 0) or 0)
+    payout = float(deal.get('payout_price', 0) or 0)
+    return payout - retail * factor - shipping
+
+
+def retailer_terms(profile: dict, retailer_columns: dict) -> tuple:
+    """(cost factors, shipping) arrays of a profile, one cell per retailer column.
+
+    Defaults fill the whole row; per-retailer overrides only touch their cells.
+    """
+    factors = np.empty(len(retailer_columns), dtype=np.float32)
+    shipping = np.empty_like(factors)
+    factors[:], shipping[:] = profile_terms({**profile, 'retailers': {}}, '')
+    for retailer in profile.get('retailers', {}):
+        column = retailer_columns.get(retailer)
+        if column is not None:
+            factors[column], shipping[column] = profile_terms(profile, retailer)
+    return factors, shipping
+
+
+class NetProfitScores:
+    """Net profit of every deal for every profiled user, as one float32 matrix"""
+
+    def __init__(self, deal_ids: list, user_ids: list, net: np.ndarray,
+                 retail: np.ndarray, payout: np.ndarray, retailer_index: np.ndarray, retailer_columns: dict):
+        self.deal_ids = deal_ids
+        self.user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+        self.net = net
+        self.retail = retail
+        self.payout = payout
+        self.retailer_index = retailer_index
+        self.retailer_columns = retailer_columns
+        # Rows of users whose profile was created after the matrix was built
+        self.extra_rows = {}
+
+    def __contains__(self, user_id):
+        return user_id in self.user_rows or user_id in self.extra_rows
+
+    def _row(self, user_id) -> np.ndarray:
+        row = self.extra_rows.get(user_id)
+        return row if row is not None else self.net[self.user_rows[user_id]]
+
+    def update_user(self, user_id, profile: dict = None):
+        """Recompute a single user's row after a profile edit (None drops it)"""
+        if profile is None:
+            self.user_rows.pop(user_id, None)
+            self.extra_rows.pop(user_id, None)
+            return
+        factors, shipping = retailer_terms(profile, self.retailer_columns)
+        row = self.payout - factors[self.retailer_index] * self.retail - shipping[self.retailer_index]
+        if user_id in self.user_rows:
+            self.net[self.user_rows[user_id]] = row
+        else:
+            self.extra_rows[user_id] = row
+
+    def for_user(self, user_id) -> dict:
+        """Net profit per deal id for a user"""
+        return dict(zip(self.deal_ids, self._row(user_id).tolist()))
+
+    def ranked(self, user_id, n: int = None, positive_only: bool = False) -> list:
+        """Deal ids ordered by the user's net profit, best first"""
+        row = self._row(user_id)
+        order = np.argsort(-row, kind='stable')
+        if positive_only:
+            order = order[row[order] > 0]
+        if n is not None:
+            order = order[:n]
+        return [self.deal_ids[index] for index in order]
+
+
+def score_catalog(deals: list, profiles: dict) -> NetProfitScores:
+    """Compute net profit for all profiles over all deals in one vectorized pass.
+
+    Deals become price arrays plus a retailer column index; profiles become
+    (users x retailers) matrices of cost factors and shipping. Net profit is
+    then a gather and two broadcast operations, processed in blocks of users
+    to bound the temporaries.
+    """
+    deal_ids = [str(deal.get('deal_id')) for deal in deals]
+    user_ids = list(profiles)
+
+    retailer_columns = {}
+    retailer_index = np.empty(len(deals), dtype=np.intp)
+    for position, deal in enumerate(deals):
+        retailers = deal_retailers(deal)
+        retailer = retailers[0] if retailers else ''
+        retailer_index[position] = retailer_columns.setdefault(retailer, len(retailer_columns))
+    retail = np.array([float(deal.get('retail_price', 0) or 0) for deal in deals], dtype=np.float32)
+    payout = np.array([float(deal.get('payout_price', 0) or 0) for deal in deals], dtype=np.float32)
+
+    factors = np.empty((len(user_ids), len(retailer_columns)), dtype=np.float32)
+    shipping = np.empty_like(factors)
+    for row, user_id in enumerate(user_ids):
+        factors[row], shipping[row] = retailer_terms(profiles[user_id], retailer_columns)
+
+    net = np.empty((len(user_ids), len(deals)), dtype=np.float32)
+    block = max(1, BLOCK_ELEMENTS // max(1, len(deals)))
+    for start in range(0, len(user_ids), block):
+        stop = start + block
+        out = net[start:stop]
+        np.multiply(factors[start:stop][:, retailer_index], retail, out=out)
+        np.subtract(payout, out, out=out)
+        out -= shipping[start:stop][:, retailer_index]
+
+    return NetProfitScores(deal_ids, user_ids, net, retail, payout, retailer_index, retailer_columns)
+
+
+class CatalogScores:
+    """Net profit scores kept in step with a DealCatalog and user profiles.
+
+    The full matrix is rebuilt in a worker thread, at most once per catalog
+    version, so a rebuild never stalls the event loop; a profile edit only
+    recomputes that user's row. Deals and profiles are copied before the
+    thread starts, as handlers keep editing them meanwhile.
+    """
+
+    def __init__(self, catalog, profiles: dict):
+        self.catalog = catalog
+        self.profiles = profiles
+        self._scores = None
+        self._version = None
+        self._rebuild = None
+        # Users whose profile changed while a rebuild was running
+        self._edited = set()
+
+    def refresh(self):
+        """Start a background rebuild if the catalog changed (the running one if any)"""
+        if self._rebuild is not None and not self._rebuild.done():
+            return self._rebuild
+        if self._scores is not None and self._version == self.catalog.version:
+            return None
+        self._rebuild = asyncio.create_task(self._rebuild_scores())
+        return self._rebuild
+
+    async def _rebuild_scores(self):
+        version = self.catalog.version
+        deals = list(self.catalog.deals.values())
+        profiles = {
+            user_id: {**profile, 'retailers': {
+                retailer: dict(terms) for retailer, terms in profile.get('retailers', {}).items()
+            }}
+            for user_id, profile in self.profiles.items()
+        }
+        self._edited.clear()
+        scores = await asyncio.to_thread(score_catalog, deals, profiles)
+        for user_id in self._edited:
+            scores.update_user(user_id, self.profiles.get(user_id))
+        self._edited.clear()
+        self._scores, self._version = scores, version
+        logger.info(f"Scored {len(deals)} deals for {len(profiles)} profiles")
+
+    async def scores(self) -> NetProfitScores:
+        rebuild = self.refresh()
+        if rebuild is not None:
+            await rebuild
+        return self._scores
+
+    def update_user(self, user_id):
+        """Bring a user's row in line with their profile after an edit"""
+        if self._rebuild is not None and not self._rebuild.done():
+            self._edited.add(user_id)
+        if self._scores is not None:
+            self._scores.update_user(user_id, self.profiles.get(user_id))
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+import os
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Transient user_data keys that must never reach the disk
+SENSITIVE_KEYS = ('api_key',)
+
+
+class SnapshotPersistence(BasePersistence):
+    """Snapshots sessions, credentials, profiles, the deal catalog and the
+    reservation ledger to local JSON files.
+
+    Every user session lives in its own file and a file is only rewritten when
+    its content changed, so a periodic snapshot costs one small write per
+    active user. The catalog and the ledger carry a version that is bumped
+    on every change, so an unchanged one is not serialized again.
+
+    All disk I/O runs in a worker thread, off the event loop. The state is
+    copied on the event loop first, so the thread never iterates over dicts
+    that handlers are mutating.
+    """
+
+    def __init__(self, directory: str, catalog, credentials: dict, profiles: dict = None,
+                 ledger=None, update_interval: float = 30):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.directory = directory
+        self.catalog = catalog
+        self.credentials = credentials
+        self.profiles = profiles if profiles is not None else {}
+        self.ledger = ledger
+        self._ledger_version = None
+        self._written = {}
+        self._catalog_version = None
+        self._catalog_restored = False
+        os.makedirs(os.path.join(directory, 'users'), exist_ok=True)
+
+    # Disk helpers (run in a worker thread)
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read(self, name: str):
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        self._written[name] = payload
+        try:
+            return json.loads(payload)
+        except ValueError as e:
+            logger.error(f"Ignoring corrupt snapshot {name}: {e}")
+            return None
+
+    def _write(self, name: str, data):
+        payload = json.dumps(data, default=str)
+        if self._written.get(name) == payload:
+            return
+        path = self._path(name)
+        tmp_path = f"{path}.tmp"
+        # Snapshots contain API secrets, so keep them private to the bot user
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        self._written[name] = payload
+
+    def _delete(self, name: str):
+        self._written.pop(name, None)
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def _restore_catalog(self):
+        if self._catalog_restored:
+            return
+        self._catalog_restored = True
+        data = self._read('catalog.json')
+        if data:
+            self.catalog.load_snapshot(data)
+        self._catalog_version = self.catalog.version
+
+    # Sessions are loaded eagerly: python-telegram-bot reads user_data once
+    # during Application.initialize, and each session file is small
+    def _load_users(self) -> dict:
+        self._restore_catalog()
+        user_data = {}
+        for filename in os.listdir(self._path('users')):
+            if not filename.endswith('.json') or not filename[:-5].isdigit():
+                continue
+            data = self._read(os.path.join('users', filename))
+            if data is None:
+                continue
+            user_data[int(filename[:-5])] = self._decode_session(data)
+        logger.info(f"Restored {len(user_data)} user sessions")
+        return user_data
+
+    def _load_bot_data(self) -> dict:
+        self._restore_catalog()
+        credentials = self._read('credentials.json')
+        if credentials:
+            for user_id, accounts in credentials.items():
+                # Older snapshots hold a single account dict per user
+                if isinstance(accounts, dict):
+                    accounts = [{'label': "Account 1", 'unit_limit': None, **accounts}]
+                self.credentials[user_id] = accounts
+        profiles = self._read('profiles.json')
+        if profiles:
+            self.profiles.update(profiles)
+        if self.ledger is not None:
+            ledger = self._read('ledger.json')
+            if ledger:
+                self.ledger.load_snapshot(ledger)
+            self._ledger_version = self.ledger.version
+        return self._read('bot_data.json') or {}
+
+    def _save_bot_data(self, data: dict, credentials: dict, profiles: dict, catalog, ledger):
+        self._write('bot_data.json', data)
+        self._write('credentials.json', credentials)
+        self._write('profiles.json', profiles)
+        if catalog is not None:
+            self._write('catalog.json', catalog)
+        if ledger is not None:
+            self._write('ledger.json', ledger)
+
+    # Sessions keep deal ids instead of full deal copies; the deals come back
+    # from the restored catalog
+    def _encode_session(self, data: dict) -> dict:
+        session = {key: value for key, value in data.items() if key not in SENSITIVE_KEYS}
+        if 'current_deals' in session:
+            session['current_deals'] = [str(deal.get('deal_id')) for deal in session['current_deals']]
+        return session
+
+    def _decode_session(self, session: dict) -> dict:
+        if 'current_deals' in session:
+            deals = [self.catalog.get(deal_id) for deal_id in session['current_deals']]
+            session['current_deals'] = [deal for deal in deals if deal is not None]
+            if session['current_deals']:
+                index = session.get('current_deal_index', 0)
+                session['current_deal_index'] = min(index, len(session['current_deals']) - 1)
+            else:
+                del session['current_deals']
+                session.pop('current_deal_index', None)
+        return session
+
+    # BasePersistence interface
+    async def get_user_data(self) -> dict:
+        return await asyncio.to_thread(self._load_users)
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return await asyncio.to_thread(self._load_bot_data)
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict):
+        session = self._encode_session(data)
+        await asyncio.to_thread(self._write, os.path.join('users', f"{user_id}.json"), session)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        version = self.catalog.version
+        catalog = self.catalog.to_snapshot() if version != self._catalog_version else None
+        credentials = {user_id: list(accounts) for user_id, accounts in self.credentials.items()}
+        profiles = json.loads(json.dumps(self.profiles))
+        ledger = None
+        ledger_version = self._ledger_version
+        if self.ledger is not None and self.ledger.version != self._ledger_version:
+            ledger_version = self.ledger.version
+            ledger = self.ledger.to_snapshot()
+        await asyncio.to_thread(self._save_bot_data, dict(data), credentials, profiles, catalog, ledger)
+        self._catalog_version = version
+        self._ledger_version = ledger_version
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        await asyncio.to_thread(self._delete, os.path.join('users', f"{user_id}.json"))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        # Every snapshot is written as soon as it is taken; nothing is buffered
+        pass
@@ -0,0 +1,159 @@
+import asyncio
+from collections import OrderedDict, deque
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a reservation attempt made on behalf of a watcher
+RESERVED = 'reserved'
+RETRY = 'retry'
+FAILED = 'failed'
+
+
+class PollBudget:
+    """Global cap on upstream calls: at most per_minute in any 60 s window.
+
+    Calls may burst (a fan-out across accounts after a reopen goes out at
+    once) as long as the window still has room; otherwise acquire waits.
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._calls = deque()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._calls and now - self._calls[0] >= 60:
+                self._calls.popleft()
+            if len(self._calls) < self.per_minute:
+                self._calls.append(now)
+                return
+            await asyncio.sleep(60 - (now - self._calls[0]))
+
+
+class DealWatcher:
+    """Watches closed deals and reserves for waiting users once they reopen.
+
+    Every watched deal gets a single poll task, however many users wait on it.
+    A poll is the reservation attempt of the longest-waiting user, so the
+    first sign of a reopened deal is already a reservation; the remaining
+    users are then served straight away. Polls run fast near times of day
+    when deals were seen reopening and back off exponentially otherwise.
+
+    attempt(deal_id, watch, budget) must acquire one slot of the global
+    PollBudget before each upstream call it makes, so a user with several
+    accounts costs one slot per account.
+    """
+
+    def __init__(self, attempt, on_expire=None, max_polls_per_minute: int = 30,
+                 fast_interval: float = 5, base_interval: float = 30, max_interval: float = 300,
+                 reopen_margin: float = 600, ttl: float = 24 * 3600):
+        self.attempt = attempt
+        self.on_expire = on_expire
+        self.budget = PollBudget(max_polls_per_minute)
+        self.fast_interval = fast_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.reopen_margin = reopen_margin
+        self.ttl = ttl
+        self._watches = {}
+        self._failures = {}
+        self._tasks = {}
+        # Seconds of the day at which deals were seen reopening
+        self._reopen_times = {}
+        self._global_reopen_times = deque(maxlen=50)
+
+    def watch(self, deal_id: str, key, watch: dict):
+        """Queue a watcher for a deal and make sure the deal is being polled"""
+        watch['expires_at'] = time.time() + self.ttl
+        self._watches.setdefault(deal_id, OrderedDict())[key] = watch
+        task = self._tasks.get(deal_id)
+        if task is None or task.done():
+            self._failures[deal_id] = 0
+            self._tasks[deal_id] = asyncio.create_task(self._run(deal_id))
+
+    def unwatch(self, predicate) -> int:
+        """Remove every watcher for which predicate(watch) is true"""
+        removed = 0
+        for watches in self._watches.values():
+            for key in [key for key, watch in watches.items() if predicate(watch)]:
+                del watches[key]
+                removed += 1
+        return removed
+
+    def watching(self, predicate) -> list:
+        """(deal_id, watch) pairs for which predicate(watch) is true"""
+        return [
+            (deal_id, watch)
+            for deal_id, watches in self._watches.items()
+            for watch in watches.values()
+            if predicate(watch)
+        ]
+
+    def next_interval(self, deal_id: str) -> float:
+        """Seconds until the next poll of a deal"""
+        if self._near_reopen(deal_id):
+            return self.fast_interval
+        backoff = self.base_interval * 2 ** min(self._failures.get(deal_id, 0), 10)
+        return min(backoff, self.max_interval)
+
+    def _near_reopen(self, deal_id: str) -> bool:
+        now = time.localtime()
+        seconds = now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec
+        for seen in list(self._reopen_times.get(deal_id, ())) + list(self._global_reopen_times):
+            distance = abs(seconds - seen)
+            if min(distance, 86400 - distance) <= self.reopen_margin:
+                return True
+        return False
+
+    def _record_reopen(self, deal_id: str):
+        now = time.localtime()
+        seconds = now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec
+        self._reopen_times.setdefault(deal_id, deque(maxlen=10)).append(seconds)
+        self._global_reopen_times.append(seconds)
+        logger.info(f"Deal {deal_id} reopened")
+
+    async def _expire(self, deal_id: str, watches: OrderedDict):
+        now = time.time()
+        for key in [key for key, watch in watches.items() if watch['expires_at'] <= now]:
+            watch = watches.pop(key)
+            if self.on_expire:
+                try:
+                    await self.on_expire(deal_id, watch)
+                except Exception as e:
+                    logger.error(f"Error expiring watch on deal {deal_id}: {e}")
+
+    async def _run(self, deal_id: str):
+        watches = self._watches[deal_id]
+        try:
+            while watches:
+                await asyncio.sleep(self.next_interval(deal_id))
+                await self._expire(deal_id, watches)
+
+                opened = False
+                for key, watch in list(watches.items()):
+                    if key not in watches:
+                        continue
+                    try:
+                        outcome = await self.attempt(deal_id, watch, self.budget)
+                    except Exception as e:
+                        logger.error(f"Error retrying deal {deal_id}: {e}")
+                        outcome = RETRY
+                    if outcome == RETRY:
+                        break
+                    watches.pop(key, None)
+                    opened = opened or outcome == RESERVED
+
+                if opened:
+                    self._record_reopen(deal_id)
+                    self._failures[deal_id] = 0
+                else:
+                    self._failures[deal_id] = self._failures.get(deal_id, 0) + 1
+        finally:
+            if not watches:
+                self._watches.pop(deal_id, None)
+                self._failures.pop(deal_id, None)
+                self._tasks.pop(deal_id, None)